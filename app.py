@@ -1,9 +1,19 @@
 import streamlit as st
-import google.generativeai as genai
-from PIL import Image
+import asyncio
+import atexit
+import hashlib
+import io
 import json
+import logging
 import os
+import pickle
+import queue
+import sqlite3
+import threading
 import datetime
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 
 # ==========================================
 # 1. PAGE CONFIGURATION & STYLING
@@ -67,10 +77,29 @@ def get_api_key():
 
 api_key = get_api_key()
 
+# Using gemini-1.5-flash for speed and cost efficiency (Free tier friendly)
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+
+# Static auditor instructions based on Moroccan Norms, attached to the model once instead of to every prompt
+SYSTEM_PROMPT = """
+You are an expert Energy Auditor in Morocco.
+Your goal is to analyze energy bills and consumption based on Moroccan Norms (AMEE, ONEE).
+Currency is Moroccan Dirham (MAD). Voltage is 220V/380V.
+
+Please provide the response in structured Markdown format with clear headings.
+Include specific recommendations for energy efficiency in Morocco.
+"""
+
+@st.cache_resource
+def get_model(key):
+    """Builds the Gemini model once per API key, reused across reruns"""
+    # Imported lazily: the gRPC/protobuf stack is only loaded once a key is available
+    import google.generativeai as genai
+    genai.configure(api_key=key)
+    return genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=SYSTEM_PROMPT)
+
 if api_key:
-    genai.configure(api_key=api_key)
-    # Using gemini-1.5-flash for speed and cost efficiency (Free tier friendly)
-    model = genai.GenerativeModel('gemini-1.5-flash')
+    model = get_model(api_key)
 else:
     st.warning("Please enter your API Key to continue.")
 
@@ -78,78 +107,425 @@ else:
 # 4. HELPER FUNCTIONS
 # ==========================================
 
-def save_report_to_history(report_data):
-    """Saves the report to a local JSON file for history"""
-    history_file = "history.json"
-    history = []
-    
-    if os.path.exists(history_file):
+# History is stored in SQLite keyed by report id, so saves, deletes and lookups don't scan the whole history
+HISTORY_DB = "history.db"
+# History file of earlier versions, imported into the database once and then renamed
+LEGACY_HISTORY_FILE = "history.json"
+# Analyzed bill images are kept here so past reports can be re-analyzed from the History page
+BILLS_DIR = "bills"
+
+def get_bill_file(image_bytes):
+    """Path a (downscaled JPEG) bill is stored under, named after its content hash"""
+    return os.path.join(BILLS_DIR, hashlib.blake2b(image_bytes, digest_size=16).hexdigest() + ".jpg")
+
+def store_bill_image(image_bytes):
+    """Saves the bill image unless an identical one is already stored, returns the file path"""
+    os.makedirs(BILLS_DIR, exist_ok=True)
+    bill_file = get_bill_file(image_bytes)
+    if not os.path.exists(bill_file):
+        with open(bill_file, "wb") as f:
+            f.write(image_bytes)
+    return bill_file
+
+def remove_unused_bill(con, bill_file):
+    """Deletes a stored bill image once no report references it anymore"""
+    if not bill_file:
+        return
+    in_use = con.execute("SELECT 1 FROM reports WHERE bill_file = ? LIMIT 1", (bill_file,)).fetchone()
+    if in_use is None and os.path.exists(bill_file):
+        os.remove(bill_file)
+
+def get_history_db():
+    """Opens the history database, creating the table on first use"""
+    con = sqlite3.connect(HISTORY_DB)
+    con.row_factory = sqlite3.Row
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS reports (
+            id TEXT PRIMARY KEY,
+            date TEXT,
+            type TEXT,
+            summary TEXT,
+            full_report BLOB,
+            bill_file TEXT,
+            prompt TEXT,
+            appliances_info TEXT,
+            report_html BLOB
+        )
+    """)
+    # Databases created before reports were pre-rendered lack the HTML column
+    columns = {row["name"] for row in con.execute("PRAGMA table_info(reports)")}
+    if "report_html" not in columns:
+        con.execute("ALTER TABLE reports ADD COLUMN report_html BLOB")
+    # The History page lists reports newest first
+    con.execute("CREATE INDEX IF NOT EXISTS reports_date ON reports (date)")
+    if os.path.exists(LEGACY_HISTORY_FILE):
+        import_legacy_history(con)
+    return con
+
+@st.cache_resource
+def get_legacy_import_lock():
+    """Process-wide lock so only one connection (writer thread or session) imports history.json"""
+    return threading.Lock()
+
+def import_legacy_history(con):
+    """Copies the reports of the old history.json into the database, then renames the file so it runs once"""
+    with get_legacy_import_lock():
+        # Another connection may have finished the import while this one waited
+        if not os.path.exists(LEGACY_HISTORY_FILE):
+            return
         try:
-            with open(history_file, "r") as f:
+            with open(LEGACY_HISTORY_FILE, "r") as f:
                 history = json.load(f)
         except:
             history = []
+        
+        with con:
+            # history.json is newest first, insert oldest first so rowid keeps the order
+            for report in reversed(history):
+                row = (
+                    report.get("date", ""),
+                    report.get("type", "Unknown"),
+                    report.get("summary", "No summary"),
+                    zlib.compress(report.get("full_report", "").encode("utf-8"), 6)
+                )
+                query = "INSERT OR IGNORE INTO reports (id, date, type, summary, full_report) VALUES (?, ?, ?, ?, ?)"
+                if con.execute(query, (report["id"],) + row).rowcount == 0:
+                    # Old timestamp ids collide on double-clicks, keep the report under its content hash instead
+                    con.execute(query, (get_report_id(report),) + row)
+        os.replace(LEGACY_HISTORY_FILE, LEGACY_HISTORY_FILE + ".migrated")
+
+def get_full_report(report):
+    """Returns the report Markdown, stored zlib-compressed (Markdown compresses 3-5x)"""
+    return zlib.decompress(report["full_report"]).decode("utf-8")
+
+def render_report_html(text):
+    """Converts the report Markdown to HTML once, so the History page doesn't re-parse it on every rerun"""
+    import mistune
+    # escape=True: raw HTML in the model output is shown as text, not injected into the page
+    markdown = mistune.create_markdown(escape=True, plugins=["table", "strikethrough"])
+    return markdown(text)
+
+def get_report_html(report):
+    """Returns the pre-rendered report HTML, or None for reports saved before pre-rendering"""
+    if report.get("report_html"):
+        return zlib.decompress(report["report_html"]).decode("utf-8")
+    return None
+
+def get_report_id(report_data):
+    """Hash of the report with its inputs (bill, prompt, appliances), identical analyses share the same id"""
+    bill = report_data.get("bill")
+    # The stored bill path is itself a content hash, so a re-analyzed report hashes like a fresh upload
+    bill_file = get_bill_file(bill) if bill else report_data.get("bill_file")
+    hasher = hashlib.blake2b(digest_size=8)
+    for part in (
+        report_data.get("type", "Unknown"),
+        bill_file or "",
+        report_data.get("prompt") or "",
+        report_data.get("appliances_info") or "",
+        report_data.get("full_report", "")
+    ):
+        # NUL separators keep e.g. ("ab", "c") and ("a", "bc") apart
+        hasher.update(part.encode("utf-8") + b"\0")
+    return hasher.hexdigest()
+
+@st.cache_resource
+def get_history_writer():
+    """Single background thread shared by all sessions, so history writes don't block a rerun and stay in order"""
+    executor = ThreadPoolExecutor(max_workers=1)
+    # Let queued writes finish when Streamlit shuts down
+    atexit.register(executor.shutdown, wait=True)
+    return executor
+
+def submit_history_write(fn, *args):
+    """Queues a history write; a failure is logged and kept in this session's state until load_history shows it"""
+    errors = st.session_state.setdefault("history_write_errors", [])
     
-    # Add new report with timestamp
-    report_entry = {
-        "id": datetime.datetime.now().strftime("%Y%m%d%H%M%S"),
-        "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-        "type": report_data.get("type", "Unknown"),
-        "summary": report_data.get("summary", "No summary"),
-        "full_report": report_data.get("full_report", "")
-    }
+    def record_failure(future):
+        error = future.exception()
+        if error is not None:
+            logging.error("History write failed", exc_info=error)
+            errors.append(str(error))
     
-    history.insert(0, report_entry) # Add to top
+    get_history_writer().submit(fn, *args).add_done_callback(record_failure)
+
+def wait_for_history_writes():
+    """Blocks until every queued save/delete has run (the writer runs tasks in order), returns and clears their failures"""
+    get_history_writer().submit(lambda: None).result()
+    errors = st.session_state.get("history_write_errors", [])
+    failures = list(errors)
+    errors.clear()
+    return failures
+
+def _write_report(report_id, date, report_data):
+    """Inserts the report in the history database, runs on the history writer thread"""
+    bill = report_data.get("bill")
+    bill_file = get_bill_file(bill) if bill else report_data.get("bill_file")
     
-    with open(history_file, "w") as f:
-        json.dump(history, f, indent=4)
+    with closing(get_history_db()) as con, con:
+        # Identical reports share an id, so an already saved one is ignored
+        inserted = con.execute(
+            """
+            INSERT OR IGNORE INTO reports
+                (id, date, type, summary, full_report, bill_file, prompt, appliances_info, report_html)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                report_id,
+                date,
+                report_data.get("type", "Unknown"),
+                report_data.get("summary", "No summary"),
+                zlib.compress(report_data.get("full_report", "").encode("utf-8"), 6),
+                # Inputs needed to re-run the analysis later
+                bill_file,
+                report_data.get("prompt"),
+                report_data.get("appliances_info"),
+                zlib.compress(render_report_html(report_data.get("full_report", "")).encode("utf-8"), 6)
+            )
+        ).rowcount
+        # Written inside the transaction: only for a new row, and a failed write rolls the row back
+        if inserted and bill:
+            store_bill_image(bill)
+
+def save_report_to_history(report_data):
+    """Queues the report for saving to the local history database, returns its id right away"""
+    report_id = get_report_id(report_data)
+    date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    submit_history_write(_write_report, report_id, date, report_data)
+    return report_id
+
+def get_history_version():
+    """Returns (mtime, size) of the history database, changes whenever a report is saved or deleted"""
+    if os.path.exists(HISTORY_DB):
+        stat = os.stat(HISTORY_DB)
+        return (stat.st_mtime_ns, stat.st_size)
+    return None
 
 def load_history():
-    """Loads history from JSON file"""
-    history_file = "history.json"
-    if os.path.exists(history_file):
-        try:
-            with open(history_file, "r") as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+    """Loads history from the database, newest first (queried once per session until the database changes)"""
+    for failure in wait_for_history_writes():
+        st.error(f"A report could not be saved or deleted: {failure}")
+    version = get_history_version()
+    if "history" not in st.session_state or st.session_state.get("history_version") != version:
+        with closing(get_history_db()) as con:
+            # rowid breaks ties between reports saved in the same minute
+            rows = con.execute("SELECT * FROM reports ORDER BY date DESC, rowid DESC").fetchall()
+        st.session_state.history = [dict(row) for row in rows]
+        st.session_state.history_version = version
+    return st.session_state.history
+
+def _delete_report(report_id):
+    """Removes the report from the history database, runs on the history writer thread"""
+    with closing(get_history_db()) as con:
+        with con:
+            row = con.execute("SELECT bill_file FROM reports WHERE id = ?", (report_id,)).fetchone()
+            con.execute("DELETE FROM reports WHERE id = ?", (report_id,))
+        if row is not None:
+            remove_unused_bill(con, row["bill_file"])
 
 def delete_report(report_id):
-    """Deletes a specific report from history"""
-    history_file = "history.json"
-    history = load_history()
-    new_history = [item for item in history if item["id"] != report_id]
-    
-    with open(history_file, "w") as f:
-        json.dump(new_history, f, indent=4)
+    """Deletes a specific report from history (queued behind any pending save)"""
+    submit_history_write(_delete_report, report_id)
 
-def analyze_image_with_gemini(image, prompt, is_detailed=False, appliances_info=None):
-    """Sends image and prompt to Gemini AI"""
-    if not api_key:
-        return "Error: API Key not provided."
+# Bills are downscaled to this longest edge and re-encoded before upload, full resolution is not needed for OCR
+MAX_IMAGE_SIDE = 1024
+JPEG_QUALITY = 80
+# Uploads above this many pixels are refused unless they are JPEGs, which the decoder can shrink while decoding
+MAX_IMAGE_PIXELS = 20_000_000
+
+# Cached on the upload bytes: reruns (e.g. typing in the appliance list) don't re-decode and resize every bill
+@st.cache_data(show_spinner=False, max_entries=100)
+def prepare_bill_image(image_bytes):
+    """Downscales and re-encodes an uploaded bill as JPEG, returns (image_bytes, mime_type) or raises ValueError if too large or unreadable"""
+    # Only the audit pages need Pillow, keep it out of the Home/History reruns
+    from PIL import Image, JpegImagePlugin, UnidentifiedImageError
+    
+    # Image.open only parses the header, pixels are decoded on first access
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+    except Image.DecompressionBombError:
+        raise ValueError("Image is far too large, please upload a smaller photo.")
+    except UnidentifiedImageError:
+        raise ValueError("File is not a readable image.")
+    # Phone photos are often reported as MPO, a JpegImageFile subclass that still decodes and drafts as a JPEG
+    is_jpeg = isinstance(image, JpegImagePlugin.JpegImageFile)
+    if is_jpeg and max(image.size) <= MAX_IMAGE_SIDE:
+        # Already small enough, forward the original bytes without decoding them
+        return image_bytes, "image/jpeg"
+    
+    # Checked from the header alone, before any pixel is decoded
+    width, height = image.size
+    if not is_jpeg and width * height > MAX_IMAGE_PIXELS:
+        raise ValueError(f"Image is too large ({width}x{height}), please upload a photo under 20 megapixels or a JPEG.")
     
     try:
-        # Construct the full prompt based on Moroccan Norms
-        full_prompt = f"""
-        You are an expert Energy Auditor in Morocco. 
-        Your goal is to analyze energy bills and consumption based on Moroccan Norms (AMEE, ONEE).
-        Currency is Moroccan Dirham (MAD). Voltage is 220V/380V.
+        # Let the JPEG decoder scale down while decoding instead of decoding at full size
+        image.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.Resampling.LANCZOS)
         
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=JPEG_QUALITY)
+    except OSError:
+        # A valid header with truncated or corrupt pixel data
+        raise ValueError("Image data is corrupt or incomplete.")
+    return buffer.getvalue(), "image/jpeg"
+
+# Max number of Gemini requests in flight at once across all sessions (free tier is capped at 500 QPM)
+GEMINI_MAX_CONCURRENCY = 10
+
+# Gemini responses are pickled here, keyed on (model, system prompt, prompt, image) so re-uploads skip the API
+RESPONSE_CACHE_DIR = "cache"
+
+def get_cache_key(image_bytes, full_prompt):
+    """Hashes the model name, prompts and raw image bytes into a cache token"""
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(GEMINI_MODEL_NAME.encode("utf-8"))
+    hasher.update(SYSTEM_PROMPT.encode("utf-8"))
+    hasher.update(full_prompt.encode("utf-8"))
+    hasher.update(image_bytes)
+    return hasher.hexdigest()
+
+def load_cached_response(cache_key):
+    """Returns a previously stored Gemini response, or None"""
+    cache_file = os.path.join(RESPONSE_CACHE_DIR, f"{cache_key}.pkl")
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                return pickle.load(f)
+        except:
+            return None
+    return None
+
+def store_cached_response(cache_key, text):
+    """Persists a Gemini response so identical requests are answered from disk"""
+    os.makedirs(RESPONSE_CACHE_DIR, exist_ok=True)
+    with open(os.path.join(RESPONSE_CACHE_DIR, f"{cache_key}.pkl"), "wb") as f:
+        pickle.dump(text, f)
+
+# Per-request prompts, built once at import; analyze_simple/analyze_detailed only fill in the task and appliances
+SIMPLE_TMPL = """
         TASK:
-        {prompt}
-        
-        {"ADDITIONAL DATA PROVIDED BY USER (Appliances):" + appliances_info if is_detailed else ""}
+        {task}
+        """
+
+DETAILED_TMPL = """
+        TASK:
+        {task}
         
-        Please provide the response in structured Markdown format with clear headings.
-        Include specific recommendations for energy efficiency in Morocco.
+        ADDITIONAL DATA PROVIDED BY USER (Appliances):{appliances}
         """
+
+@st.cache_resource
+def get_gemini_loop():
+    """One event loop on a background thread for the whole process: the model's async gRPC client is bound to the loop that first used it"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+@st.cache_resource
+def get_gemini_semaphore():
+    """Caps Gemini requests in flight across all sessions, created on the shared loop that all calls run on"""
+    async def create():
+        return asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    return asyncio.run_coroutine_threadsafe(create(), get_gemini_loop()).result()
+
+def run_on_gemini_loop(make_coroutine, placeholders=None):
+    """Runs make_coroutine(on_text) on the shared loop, rendering its on_text(index, text) updates into placeholders from the script thread"""
+    updates = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        make_coroutine(lambda index, text: updates.put((index, text))),
+        get_gemini_loop()
+    )
+    # Streamlit elements can only be updated from the script thread, so the loop hands chunks over through the queue
+    while not (future.done() and updates.empty()):
+        try:
+            index, text = updates.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if placeholders:
+            placeholders[index].markdown(text)
+    return future.result()
+
+def is_error_result(result):
+    """Failed analyses come back as an error message instead of a report"""
+    return not result or result.startswith("Error")
+
+async def _call_model(full_prompt, image_bytes, mime_type, semaphore=None, use_cache=True, on_text=None):
+    """Sends the prompt and image to Gemini AI without blocking the event loop, streaming partial text to on_text if given"""
+    if not api_key:
+        return "Error: API Key not provided."
+    
+    try:
+        cache_key = get_cache_key(image_bytes, full_prompt)
+        cached = load_cached_response(cache_key) if use_cache else None
+        if cached is not None:
+            return cached
         
-        response = model.generate_content([full_prompt, image])
-        return response.text
+        # Raw encoded bytes are forwarded as-is, Gemini decodes the image server-side
+        image_part = {"mime_type": mime_type, "data": image_bytes}
+        async with semaphore or asyncio.Semaphore(1):
+            if on_text is None:
+                response = await model.generate_content_async([full_prompt, image_part])
+                text = response.text
+            else:
+                # Render the report while it is generated instead of blocking until the last token
+                response = await model.generate_content_async([full_prompt, image_part], stream=True)
+                chunks = []
+                async for chunk in response:
+                    chunks.append(chunk.text)
+                    on_text("".join(chunks))
+                text = "".join(chunks)
+        store_cached_response(cache_key, text)
+        return text
     except Exception as e:
         return f"Error during analysis: {str(e)}"
 
+async def analyze_simple(image_bytes, mime_type, task, **kwargs):
+    """Analyzes a bill on its own"""
+    return await _call_model(SIMPLE_TMPL.format(task=task), image_bytes, mime_type, **kwargs)
+
+async def analyze_detailed(image_bytes, mime_type, task, appliances, **kwargs):
+    """Analyzes a bill against the user's appliance list"""
+    return await _call_model(DETAILED_TMPL.format(task=task, appliances=appliances), image_bytes, mime_type, **kwargs)
+
+def analyze_images_with_gemini(bills, analyze, *args, placeholders=None):
+    """Runs analyze_simple/analyze_detailed on several (image_bytes, mime_type) bills concurrently, results are returned in upload order"""
+    semaphore = get_gemini_semaphore()
+    
+    async def run_all(on_text):
+        return await asyncio.gather(*[
+            analyze(
+                image_bytes, mime_type, *args, semaphore=semaphore,
+                on_text=(lambda text, index=index: on_text(index, text)) if placeholders else None
+            )
+            for index, (image_bytes, mime_type) in enumerate(bills)
+        ])
+    
+    return run_on_gemini_loop(run_all, placeholders)
+
+def reanalyze_reports(reports):
+    """Re-runs Gemini on the stored bills of several history reports concurrently, bypassing the response cache"""
+    semaphore = get_gemini_semaphore()
+    
+    async def reanalyze(report):
+        try:
+            with open(report["bill_file"], "rb") as f:
+                image_bytes = f.read()
+        except OSError as e:
+            # The report and its bill may have been deleted by another session since the page was drawn
+            return f"Error: the bill image could not be read ({e})"
+        if report["type"] == "Detailed Audit":
+            return await analyze_detailed(image_bytes, "image/jpeg", report["prompt"], report["appliances_info"], semaphore=semaphore, use_cache=False)
+        return await analyze_simple(image_bytes, "image/jpeg", report["prompt"], semaphore=semaphore, use_cache=False)
+    
+    async def run_all(on_text):
+        return await asyncio.gather(*[reanalyze(report) for report in reports])
+    
+    return run_on_gemini_loop(run_all)
+
+def can_reanalyze(report):
+    """Only reports saved with their bill image and prompt can be re-run"""
+    return bool(report.get("prompt")) and bool(report.get("bill_file")) and os.path.exists(report["bill_file"])
+
 # ==========================================
 # 5. PAGE: HOME
 # ==========================================
@@ -186,15 +562,23 @@ elif page == "📄 Simple Audit":
     col1, col2 = st.columns([1, 1])
     
     with col1:
-        uploaded_file = st.file_uploader("Choose Bill Image...", type=["jpg", "jpeg", "png"])
+        uploaded_files = st.file_uploader("Choose Bill Image(s)...", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
         
-        if uploaded_file is not None:
-            image = Image.open(uploaded_file)
-            st.image(image, caption='Uploaded Bill', use_column_width=True)
+        bills = []
+        bill_names = []
+        for uploaded_file in uploaded_files:
+            try:
+                image_bytes, mime_type = prepare_bill_image(uploaded_file.getvalue())
+            except ValueError as e:
+                st.error(f"{uploaded_file.name}: {e}")
+                continue
+            bills.append((image_bytes, mime_type))
+            bill_names.append(uploaded_file.name)
+            st.image(image_bytes, caption=f'Uploaded Bill: {uploaded_file.name}', use_column_width=True)
     
     with col2:
         st.subheader("Analysis Result")
-        if uploaded_file is not None:
+        if bills:
             if st.button("🚀 Analyze Bill"):
                 with st.spinner("AI is analyzing your bill based on Moroccan norms..."):
                     prompt = """
@@ -204,20 +588,32 @@ elif page == "📄 Simple Audit":
                     4. Analyze if the consumption is high for a standard household in Morocco.
                     5. Provide 3 specific recommendations to reduce this bill.
                     """
-                    result = analyze_image_with_gemini(image, prompt)
+                    # One box per bill so each report streams into its own slot
+                    boxes, placeholders = [], []
+                    for bill_name in bill_names:
+                        box = st.container()
+                        box.markdown(f"### 📊 Report - {bill_name}")
+                        boxes.append(box)
+                        placeholders.append(box.empty())
                     
-                    st.markdown("### 📊 Report")
-                    st.markdown(result)
+                    results = analyze_images_with_gemini(bills, analyze_simple, prompt, placeholders=placeholders)
                     
-                    # Save to History
-                    if result:
-                        report_data = {
-                            "type": "Simple Audit",
-                            "summary": "Simple Bill Analysis",
-                            "full_report": result
-                        }
-                        save_report_to_history(report_data)
-                        st.success("Report saved to History!")
+                    for box, placeholder, (image_bytes, _), result in zip(boxes, placeholders, bills, results):
+                        placeholder.markdown(result)
+                        
+                        # Save to History, failed analyses are only shown
+                        if is_error_result(result):
+                            box.error("Analysis failed, the report was not saved.")
+                        else:
+                            report_data = {
+                                "type": "Simple Audit",
+                                "summary": "Simple Bill Analysis",
+                                "full_report": result,
+                                "bill": image_bytes,
+                                "prompt": prompt
+                            }
+                            save_report_to_history(report_data)
+                            box.success("Report saved to History!")
         else:
             st.info("Please upload an image to start.")
 
@@ -236,10 +632,18 @@ elif page == "🔍 Detailed Audit":
     
     with col1:
         st.subheader("1. Upload Bill")
-        uploaded_file = st.file_uploader("Choose Bill Image...", type=["jpg", "jpeg", "png"], key="detailed_bill")
-        if uploaded_file is not None:
-            image = Image.open(uploaded_file)
-            st.image(image, caption='Uploaded Bill', use_column_width=True)
+        uploaded_files = st.file_uploader("Choose Bill Image(s)...", type=["jpg", "jpeg", "png"], key="detailed_bill", accept_multiple_files=True)
+        bills = []
+        bill_names = []
+        for uploaded_file in uploaded_files:
+            try:
+                image_bytes, mime_type = prepare_bill_image(uploaded_file.getvalue())
+            except ValueError as e:
+                st.error(f"{uploaded_file.name}: {e}")
+                continue
+            bills.append((image_bytes, mime_type))
+            bill_names.append(uploaded_file.name)
+            st.image(image_bytes, caption=f'Uploaded Bill: {uploaded_file.name}', use_column_width=True)
     
     with col2:
         st.subheader("2. Appliance Information")
@@ -252,7 +656,7 @@ elif page == "🔍 Detailed Audit":
     
     st.markdown("---")
     if st.button("🚀 Generate Detailed Report"):
-        if uploaded_file is not None and appliance_info:
+        if bills and appliance_info:
             with st.spinner("AI is comparing bill data with appliance usage..."):
                 prompt = """
                 1. Extract total consumption (kWh) and cost (MAD) from the uploaded bill.
@@ -262,21 +666,34 @@ elif page == "🔍 Detailed Audit":
                 5. Identify discrepancies (e.g., hidden consumption, old appliances, insulation issues).
                 6. Provide a detailed action plan to optimize energy use according to Moroccan standards.
                 """
-                result = analyze_image_with_gemini(image, prompt, is_detailed=True, appliances_info=appliance_info)
+                # One box per bill so each report streams into its own slot
+                boxes, placeholders = [], []
+                for bill_name in bill_names:
+                    box = st.container()
+                    box.markdown(f"### 📊 Detailed Report - {bill_name}")
+                    boxes.append(box)
+                    placeholders.append(box.empty())
                 
-                st.markdown("### 📊 Detailed Report")
-                st.markdown(result)
+                results = analyze_images_with_gemini(bills, analyze_detailed, prompt, appliance_info, placeholders=placeholders)
                 
-                # Save to History
-                if result:
-                    report_data = {
-                        "type": "Detailed Audit",
-                        "summary": "Detailed Analysis with Appliances",
-                        "full_report": result
-                    }
-                    save_report_to_history(report_data)
-                    st.success("Detailed Report saved to History!")
-        elif not uploaded_file:
+                for box, placeholder, (image_bytes, _), result in zip(boxes, placeholders, bills, results):
+                    placeholder.markdown(result)
+                    
+                    # Save to History, failed analyses are only shown
+                    if is_error_result(result):
+                        box.error("Analysis failed, the report was not saved.")
+                    else:
+                        report_data = {
+                            "type": "Detailed Audit",
+                            "summary": "Detailed Analysis with Appliances",
+                            "full_report": result,
+                            "bill": image_bytes,
+                            "prompt": prompt,
+                            "appliances_info": appliance_info
+                        }
+                        save_report_to_history(report_data)
+                        box.success("Detailed Report saved to History!")
+        elif not bills:
             st.error("Please upload a bill image.")
         elif not appliance_info:
             st.error("Please enter appliance information.")
@@ -290,15 +707,49 @@ elif page == "📚 History":
     
     history = load_history()
     
+    # Failures from the last re-analysis, kept across the rerun that refreshed the list
+    for error in st.session_state.pop("reanalyze_errors", []):
+        st.error(error)
+    
     if not history:
         st.info("No reports found in history yet.")
     else:
+        # Bulk action on the reports ticked below
+        if st.button("🔁 Re-analyze selected"):
+            selected = [report for report in history if st.session_state.get(f"sel_{report['id']}")]
+            if not selected:
+                st.warning("Select at least one report to re-analyze.")
+            else:
+                with st.spinner(f"AI is re-analyzing {len(selected)} report(s)..."):
+                    results = reanalyze_reports(selected)
+                
+                errors = []
+                for report, result in zip(selected, results):
+                    if not is_error_result(result):
+                        # Replace the old entry with the fresh analysis
+                        new_id = save_report_to_history({**report, "full_report": result})
+                        if new_id != report['id']:
+                            delete_report(report['id'])
+                    else:
+                        errors.append(f"{report['type']} - {report['date']}: {result}")
+                st.session_state.reanalyze_errors = errors
+                st.rerun() # Refresh page to show changes
+        
         # Display history in reverse chronological order
         for report in history:
             with st.expander(f"📄 {report['type']} - {report['date']}"):
+                st.checkbox(
+                    "Select for re-analysis",
+                    key=f"sel_{report['id']}",
+                    disabled=not can_reanalyze(report)
+                )
                 st.markdown(f"**Summary:** {report['summary']}")
                 st.markdown("---")
-                st.markdown(report['full_report'])
+                report_html = get_report_html(report)
+                if report_html is not None:
+                    st.markdown(report_html, unsafe_allow_html=True)
+                else:
+                    st.markdown(get_full_report(report))
                 
                 # Delete Button
                 col_del, _ = st.columns([1, 5])